@@ -21,170 +21,564 @@
 #     OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 #     THE SOFTWARE.
 #
+import functools
+import io
+import itertools
+import mmap
+import os
+import queue
 import re
+import tempfile
+import threading
+import zipfile
+import numpy as np
+
+# Compiled parser for files which can be mapped from disk: the Cython
+# version if it has been built (it needs no compilation at run time),
+# otherwise the numba version if numba is available, otherwise none (the
+# pure-Python parser is used).
+try:
+    import parseProcarFast as _compiled
+except ImportError:
+    try:
+        import parseProcarJit as _compiled
+    except ImportError:
+        _compiled = None
+
+# Matches the integers on the global line of a PROCAR file.
+_INT_RE = re.compile(r'\d+')
+# Matches the floats (which always have a decimal point) on a k-point line.
+_FLOAT_RE = re.compile(r'-?\d+\.\d*(?:[eE][-+]?\d+)?')
+
+# Type of all floating point data stored by PROCAR. The file holds at most
+# about 8 significant digits for energies and k-points and only 3 decimal
+# places for the ion tables, so single precision loses very little while
+# halving the memory (and memory bandwidth) of every sweep over the data.
+DTYPE = np.float32
+
+# PROCAR arrays saved by PROCAR.LoadCached.
+_CACHED_ARRAYS = ('kVecs', 'weights', 'energies', 'occs', 'ionData')
+
+# Names of the numeric columns in an ion table row (the leading ion label is
+# not counted).
+COLUMNS = ('s', 'py', 'pz', 'px', 'dxy', 'dyz', 'dz2', 'dxz', 'dx2', 'tot')
+NCOLS = len(COLUMNS)
 
 # Represents the data stored in a PROCAR file.
-# Contains properties nonCol, Nk, Nb, Ni, and kPoints.
-# kPoints is a list of KPoint objects.
+# Contains properties nonCol, lmDecomposed, Nk, Nb, Ni, numTables, ncols
+# and kPoints. kPoints is a sequence of KPoint views.
+#
+# The data itself is stored as contiguous arrays of type DTYPE indexed from 0:
+#   kVecs[Nk, 3], weights[Nk]            k-point coordinates and weights
+#   energies[Nk, Nb], occs[Nk, Nb]       band energies and occupations
+#   ionData[Nk, Nb, numTables, Ni+1, ncols]
+#                                        ion table columns; row Ni holds the
+#                                        totals. ncols is NCOLS, or 1 (only
+#                                        the total column) if lmDecomposed
+#                                        is False.
+#   top[Nk, Nb, numTables], bottom[...]  top/bottom surface weights
+#   surface[Nk, Nb, numTables]           surface state flags
+# (see surface.MarkSurfaceStates for the last three).
 class PROCAR(object):
+    __slots__ = ('nonCol', 'lmDecomposed', 'storeIds', 'Nk', 'Nb', 'Ni',
+                 'ncols', 'numTables', 'kVecs', 'weights', 'energies', 'occs',
+                 'ionData', 'top', 'bottom', 'surface', '_squareSums')
+
     # Create PROCAR object by reading from the file-like object procarFile.
     # nonCol = true if this is a non-collinear calculation (2 spins: 4 spinor
     # components); otherwise nonCol = false.
     # If lmDecomposed=False, all ion table columns are discared except the
-    # total column. If storeIds=False, entry ids are not stored.
+    # total column. storeIds is kept for compatibility: entry ids are
+    # derived from the position of each view and cost no storage.
     def __init__(self, procarFile, nonCol, lmDecomposed=True, storeIds=True):
         self.nonCol = nonCol
         self.lmDecomposed = lmDecomposed
         self.storeIds = storeIds
 
+        # Use the compiled parser if the data can be mapped from disk.
+        buf = None
+        if _compiled is not None:
+            buf = _MapFile(procarFile)
+        if buf is not None:
+            self._ReadMapped(buf)
+        else:
+            self._ReadFile(procarFile)
+
+    # Return a PROCAR for the file at path. If cachePath (by default path
+    # with '.npz' appended; used as given otherwise) holds the arrays of a
+    # previous parse of the same version of the file (same size and
+    # modification time) with the same nonCol and lmDecomposed, they are
+    # loaded instead of parsing the file.
+    # Otherwise the file is parsed and its arrays are saved to cachePath.
+    @classmethod
+    def LoadCached(cls, path, nonCol, lmDecomposed=True, storeIds=True,
+                   cachePath=None):
+        if cachePath is None:
+            cachePath = path + '.npz'
+        stat = os.stat(path)
+        meta = np.array([stat.st_size, stat.st_mtime_ns, nonCol, lmDecomposed],
+                        dtype=np.int64)
+        try:
+            # open the file here: np.load leaves the files it opens itself
+            # open when they are not valid archives
+            with open(cachePath, 'rb') as cacheFile:
+                with np.load(cacheFile) as cache:
+                    if np.array_equal(cache['meta'], meta):
+                        procar = cls.__new__(cls)
+                        procar.nonCol = nonCol
+                        procar.lmDecomposed = lmDecomposed
+                        procar.storeIds = storeIds
+                        procar._Alloc(*cache['globals'])
+                        for name in _CACHED_ARRAYS:
+                            setattr(procar, name, cache[name])
+                        return procar
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # no cache yet, or it is unreadable; parse the file instead
+            pass
+        with open(path, 'r') as procarFile:
+            procar = cls(procarFile, nonCol, lmDecomposed, storeIds)
+        arrays = dict((name, getattr(procar, name)) for name in _CACHED_ARRAYS)
+        # Write to a temporary file and move it into place, so that an
+        # interrupted run never leaves a partial cache behind. Saving through
+        # a file object also keeps np.savez from appending '.npz' to names
+        # which don't end with it.
+        tmpPath = None
+        try:
+            fd, tmpPath = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(cachePath)), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as cacheFile:
+                np.savez(cacheFile, meta=meta,
+                         globals=np.array([procar.Nk, procar.Nb, procar.Ni]),
+                         **arrays)
+            os.replace(tmpPath, cachePath)
+        except OSError:
+            print("warning: Couldn't write PROCAR cache " + cachePath)
+            if tmpPath is not None and os.path.exists(tmpPath):
+                os.remove(tmpPath)
+        return procar
+
+    # Parse the PROCAR file held in the uint8 array buf with the compiled
+    # parser.
+    def _ReadMapped(self, buf):
+        # globals are on line 2
+        header = bytes(buf[:1024]).splitlines()
+        if len(header) < 2:
+            raise ValueError("PROCAR header is incomplete")
+        self._Alloc(*_ParseGlobals(header[1].decode()))
+        _compiled.ParseProcar(buf, self.kVecs, self.weights, self.energies,
+                              self.occs, self.ionData)
+
+    # Parse the PROCAR file by reading lines from the file-like object
+    # procarFile. The k-point entries are read in a background thread while
+    # earlier ones are parsed, and only a few of them are held in memory.
+    def _ReadFile(self, procarFile):
         # Start at the beginning of the file
         try:
             procarFile.seek(0)
         except:
             # if we can't seek, assume we are at the beginning
             print("warning: Couldn't seek to start of PROCAR file")
+        lines = iter(procarFile)
+        header = list(itertools.islice(lines, _HEADER_LINES))
 
-        # Get global data
-        procarFile.readline()                # discard line 1
-        globalLine = procarFile.readline()   # globals are on line 2
-        # (number of k-points, bands, and ions)
-        self.Nk, self.Nb, self.Ni = map(int, re.findall(r'\d+', globalLine))
-        procarFile.readline()       # discard line 3 (empty)
-        # Iterate over k-points.
-        # The next line read should be the first line of the first k-point entry.
-        self.kPoints = []
-        for kId in range(1, self.Nk+1):
-            # Extract k-point data.
-            self.kPoints.append(KPoint(procarFile, self, kId))
-            # Advance to the next k-point.
-            procarFile.readline() # empty line
+        # Get global data (globals are on line 2)
+        if len(header) < 2:
+            raise ValueError("PROCAR header is incomplete")
+        self._Alloc(*_ParseGlobals(header[1]))
+        # Iterate over k-points. Every entry has the same number of lines, so
+        # each can be read as a block and indexed directly.
+        linesPerKPoint = _LinesPerKPoint(self)
+        entries = _ReadAhead(lines, linesPerKPoint, self.Nk)
+        try:
+            for kIdx, entry in enumerate(entries):
+                # the entry ends with its last ion table row; the empty
+                # lines after it carry no data and may be missing at the end
+                # of the file
+                if len(entry) < linesPerKPoint-2:
+                    raise ValueError("PROCAR file ends inside k-point %d"
+                                     % (kIdx+1))
+                # Extract k-point data.
+                try:
+                    _ParseKPoint(entry, 0, self, kIdx)
+                except IndexError:
+                    raise ValueError("Malformed PROCAR entry for k-point %d"
+                                     % (kIdx+1))
+        finally:
+            # stop the reading thread now rather than when the generator is
+            # collected, which an exception's traceback can delay
+            entries.close()
+
+    # Allocate the arrays holding the data for Nk k-points, Nb bands and
+    # Ni ions.
+    def _Alloc(self, Nk, Nb, Ni):
+        ncols = NCOLS if self.lmDecomposed else 1
+        self.Nk, self.Nb, self.Ni, self.ncols = Nk, Nb, Ni, ncols
+        self.numTables = 4 if self.nonCol else 1
+        self.kVecs = np.zeros((Nk, 3), dtype=DTYPE)
+        self.weights = np.zeros(Nk, dtype=DTYPE)
+        self.energies = np.zeros((Nk, Nb), dtype=DTYPE)
+        self.occs = np.zeros((Nk, Nb), dtype=DTYPE)
+        self.ionData = np.zeros((Nk, Nb, self.numTables, Ni+1, ncols),
+                                dtype=DTYPE)
+        self.top = np.zeros((Nk, Nb, self.numTables), dtype=DTYPE)
+        self.bottom = np.zeros_like(self.top)
+        self.surface = np.zeros((Nk, Nb, self.numTables), dtype=bool)
+        self._squareSums = None
+
+    @property
+    def kPoints(self):
+        return _Views(self.Nk, functools.partial(KPoint, self))
 
     # Return data for the k-point with id given by kId in the PROCAR file
     # format (the first id is 1, not 0).
     def KPoint(self, kId):
-        return self.kPoints[kId-1]
-   
-# Represents the data for one k-point.
+        return KPoint(self, kId-1)
+
+    # Return the ion table data as a pandas DataFrame with one row per ion
+    # table row, indexed by (kId, bandId, tableId, ionId), and the columns
+    # of the table (only 'tot' if lmDecomposed=False). Ids start at 1 as in
+    # the PROCAR file; the totals row of each table has ionId 0. The frame
+    # shares its data with ionData where pandas allows it.
+    def ToDataFrame(self):
+        import pandas as pd
+        ionIds = list(range(1, self.Ni+1)) + [0]
+        index = pd.MultiIndex.from_product(
+            [range(1, self.Nk+1), range(1, self.Nb+1),
+             range(1, self.numTables+1), ionIds],
+            names=['kId', 'bandId', 'tableId', 'ionId'])
+        return pd.DataFrame(self.ionData.reshape(-1, self.ncols), index=index,
+                            columns=list(COLUMNS[NCOLS-self.ncols:]),
+                            copy=False)
+
+    # Return the sum of squares of the lm-decomposed columns of every ion
+    # table row as a DTYPE array of shape (Nk, Nb, numTables, Ni+1).
+    # If lmDecomposed=False this is the square of the total column instead.
+    # The result is computed on the first call and reused afterwards.
+    def SquareSums(self):
+        if self._squareSums is None:
+            if self.lmDecomposed:
+                lm = self.ionData[..., :NCOLS-1]
+                self._squareSums = np.einsum('...i,...i->...', lm, lm)
+            else:
+                self._squareSums = self.ionData[..., 0]**2
+        return self._squareSums
+
+# Return the number of k-points, bands, and ions given on the global line
+# (line 2) of a PROCAR file.
+def _ParseGlobals(globalLine):
+    Nk, Nb, Ni = map(int, _INT_RE.findall(globalLine))
+    return Nk, Nb, Ni
+
+# Return a read-only uint8 memory map of the file underlying procarFile, or
+# None if procarFile is not backed by a plain file on disk (for example an
+# io.StringIO or a compressed file).
+def _MapFile(procarFile):
+    raw = procarFile
+    for attr in ('buffer', 'raw'):
+        raw = getattr(raw, attr, raw)
+    if not isinstance(raw, io.FileIO):
+        return None
+    try:
+        # map the open descriptor rather than reopening the file by name,
+        # which may be a descriptor number or no longer refer to the file
+        mapped = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # e.g. empty file, or a descriptor which can't be mapped
+        return None
+    return np.frombuffer(mapped, dtype=np.uint8)
+
+# Return a generator yielding count lists of n lines taken from the iterator
+# lines. The lists are read by a background thread, at most maxBuffered
+# ahead of the consumer, so that reading (and e.g. decompressing) the file
+# overlaps with parsing. Errors raised while reading are re-raised by the
+# generator.
+def _ReadAhead(lines, n, count, maxBuffered=4):
+    buffered = queue.Queue(maxsize=maxBuffered)
+    stop = threading.Event()
+
+    # Put item in the queue unless the consumer has stopped.
+    def Put(item):
+        while not stop.is_set():
+            try:
+                buffered.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def Produce():
+        try:
+            for _ in range(count):
+                if not Put(list(itertools.islice(lines, n))):
+                    return
+        except Exception as e:
+            Put(e)
+
+    thread = threading.Thread(target=Produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        for _ in range(count):
+            item = buffered.get()
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+# Layout of a PROCAR file in lines: title, globals and an empty line; then
+# for each k-point its header, an empty line and the band entries followed
+# by an empty line. Each band entry is its header, an empty line, the ion
+# table column names and numTables tables of Ni+1 rows, followed by an empty
+# line.
+_HEADER_LINES = 3
+
+# Return the number of lines in each band entry of procar's file.
+def _LinesPerBand(procar):
+    return 3 + procar.numTables*(procar.Ni+1) + 1
+
+# Return the number of lines in each k-point entry of procar's file.
+def _LinesPerKPoint(procar):
+    return 2 + procar.Nb*_LinesPerBand(procar) + 1
+
+# Extract data for the k-point with index kIdx into procar from the list of
+# lines of a PROCAR file, where the k-point entry starts at lines[start].
+def _ParseKPoint(lines, start, procar, kIdx):
+    kHead = lines[start]
+    # the floats on the line are kx, ky, kz and the weight; kx, ky and kz
+    # may not be separated by spaces when there is a minus sign
+    kx, ky, kz, weight = _FLOAT_RE.findall(kHead)
+    procar.kVecs[kIdx] = [float(kx), float(ky), float(kz)]
+    procar.weights[kIdx] = float(weight)
+    # iterate over bands, which start after the header and an empty line
+    linesPerBand = _LinesPerBand(procar)
+    for bandIdx in range(procar.Nb):
+        # Extract band data.
+        _ParseBand(lines, start + 2 + bandIdx*linesPerBand, procar, kIdx,
+                   bandIdx)
+
+# Extract data for the band with index bandIdx at k-point kIdx into procar
+# from the list of lines of a PROCAR file, where the band entry starts at
+# lines[start].
+def _ParseBand(lines, start, procar, kIdx, bandIdx):
+    bandHead = lines[start].rstrip()
+    if not bandHead.startswith('band'):
+        raise ValueError("PROCAR band entry not found where expected")
+    # energy is the fifth group in the line, isolated by spaces; only split
+    # as far as needed to reach it
+    procar.energies[kIdx, bandIdx] = float(bandHead.split(None, 5)[4])
+    # occ is the last group in the line, isolated by spaces
+    procar.occs[kIdx, bandIdx] = float(bandHead.rpartition(' ')[2])
+    # get ion tables, skipping an empty line and the line containing
+    # "ion   s   py  pz"...etc. The tables follow each other directly, so the
+    # rows of all tables (each with a row per ion plus the totals row) are
+    # read at once.
+    tablesStart = start + 3
+    tablesEnd = tablesStart + procar.numTables*(procar.Ni+1)
+    if procar.lmDecomposed:
+        block = _ReadIonBlock(lines[tablesStart:tablesEnd])
+    else:
+        block = _ReadTotalColumn(lines[tablesStart:tablesEnd])
+    procar.ionData[kIdx, bandIdx] = block.reshape(procar.ionData.shape[2:])
+
+# Return the numeric columns (the leading ion label is skipped) of the ion
+# table rows in the list lines as a (len(lines), NCOLS) DTYPE array.
+def _ReadIonBlock(lines):
+    # drop the label from each row and tokenize the rest in a single call
+    block = ' '.join(line.split(None, 1)[1] for line in lines)
+    data = np.fromstring(block, dtype=DTYPE, sep=' ')
+    return data.reshape(len(lines), NCOLS)
+
+# Return the total column (the last one) of the ion table rows in the list
+# lines as a (len(lines), 1) DTYPE array. The other columns are not
+# tokenized.
+def _ReadTotalColumn(lines):
+    block = ' '.join(line.rsplit(None, 1)[1] for line in lines)
+    data = np.fromstring(block, dtype=DTYPE, sep=' ')
+    return data.reshape(len(lines), 1)
+
+# A read-only sequence of n views where item i is view(i), created only when
+# it is accessed. Returned for kPoints, bands, tables and ions so that no
+# list of views has to be built up front.
+class _Views(object):
+    __slots__ = ('n', 'view')
+
+    def __init__(self, n, view):
+        self.n = n
+        self.view = view
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self.view(i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.view(j) for j in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError("view index out of range")
+        return self.view(i)
+
+# Represents the data for one k-point: a view into a PROCAR's arrays.
 # Contains properties kId, kx, ky, kz, weight, and bands.
-# bands is a list of Band objects.
+# bands is a sequence of Band views.
 class KPoint(object):
-    # Extract k-point data from procarFile.
-    # The next line read should be the first line of the k-point entry.
-    def __init__(self, procarFile, procar, kId):
-        if procar.storeIds:
-            self.kId = kId
-        kHead = procarFile.readline()
-        # fixed positions since numbers overlap when there is a minus sign
-        self.kx, self.ky, self.kz = map(float, [kHead[18:29], kHead[29:40],
-                                                kHead[40:51]])
-        # weight is the last thing in the line, isolated by spaces
-        self.weight = float(kHead.rstrip().split(' ')[-1])
-        procarFile.readline() # empty line
-        # iterate over bands
-        self.bands = []
-        for bandId in range(1, procar.Nb+1):
-            # Extract band data.
-            self.bands.append(Band(procarFile, procar, bandId))
-            # Advance to the next band.
-            procarFile.readline() # empty line
+    __slots__ = ('procar', 'kIdx')
+
+    def __init__(self, procar, kIdx):
+        self.procar = procar
+        self.kIdx = kIdx
+
+    kId = property(lambda self: self.kIdx+1)
+
+    kx = property(lambda self: self.procar.kVecs[self.kIdx, 0])
+    ky = property(lambda self: self.procar.kVecs[self.kIdx, 1])
+    kz = property(lambda self: self.procar.kVecs[self.kIdx, 2])
+    weight = property(lambda self: self.procar.weights[self.kIdx])
+
+    @property
+    def bands(self):
+        return _Views(self.procar.Nb,
+                      functools.partial(Band, self.procar, self.kIdx))
 
     # Return data for the band with id given by bandId in the PROCAR file
     # format (the first id is 1, not 0).
     def Band(self, bandId):
-        return self.bands[bandId-1]
+        return Band(self.procar, self.kIdx, bandId-1)
 
-
-# Represents the data for one band belonging to a specific k-point.
-# Contains properties bandId, energy, occ, tables.
-# tables is a list of IonTable objects.
+# Represents the data for one band belonging to a specific k-point: a view
+# into a PROCAR's arrays.
+# Contains properties bandId, energy, occ, tables, top, bottom, surface.
+# tables is a sequence of IonTable views. top and bottom hold the surface
+# weights of each table and surface is True if any table was marked as a
+# surface state.
 class Band(object):
-    # Extract band data from procarFile.
-    # The next line read should be the first line of the band entry.
-    def __init__(self, procarFile, procar, bandId):
-        if procar.storeIds:
-            self.bandId = bandId
-        bandHead = procarFile.readline().strip().split()
-        # energy is the fifth group in the line, isolated by spaces
-        self.energy = float(bandHead[4])
-        # occ is the last group in the line, isolated by spaces
-        self.occ = float(bandHead[-1])
-        # get ion tables
-        procarFile.readline() # empty line
-        procarFile.readline()  # skip line containing "ion   s   py  pz"...etc
-        self.tables = []
-        numTables = 1
-        if procar.nonCol:
-            numTables = 4
-        for tableId in range(1, numTables+1):
-            # Extract table data.
-            self.tables.append(IonTable(procarFile, procar, tableId))
-        # top/bottom surface weights
-        self.top = []
-        self.bottom = []
+    __slots__ = ('procar', 'kIdx', 'bandIdx')
+
+    def __init__(self, procar, kIdx, bandIdx):
+        self.procar = procar
+        self.kIdx = kIdx
+        self.bandIdx = bandIdx
+
+    bandId = property(lambda self: self.bandIdx+1)
+
+    energy = property(lambda self: self.procar.energies[self.kIdx, self.bandIdx])
+    occ = property(lambda self: self.procar.occs[self.kIdx, self.bandIdx])
+    top = property(lambda self: self.procar.top[self.kIdx, self.bandIdx])
+    bottom = property(lambda self: self.procar.bottom[self.kIdx, self.bandIdx])
+
+    @property
+    def surface(self):
+        return bool(self.procar.surface[self.kIdx, self.bandIdx].any())
+
+    @property
+    def tables(self):
+        return _Views(self.procar.numTables,
+                      functools.partial(IonTable, self.procar, self.kIdx,
+                                        self.bandIdx))
 
     # Return data for the table with id given by tableId in the PROCAR file
     # format (the first id is 1, not 0).
     def Table(self, tableId):
-        return self.tables[tableId-1]
+        return IonTable(self.procar, self.kIdx, self.bandIdx, tableId-1)
 
-
-# Represents a table of ionic data belonging to a (k-point, band) pair.
-# Contains properties tableId, ions, tot.
-# ions is a list of Ion objects and tot is an Ion object containing the
-# total values summed over all ions.
+# Represents a table of ionic data belonging to a (k-point, band) pair: a
+# view into a PROCAR's arrays.
+# Contains properties tableId, data, ions, tot, surface.
+# data is an (Ni+1, ncols) DTYPE array holding the numeric columns of the
+# table; its last row contains the totals summed over all ions. ions is a
+# sequence of Ion (or IonTotalOnly) views into the rows of data and tot is a
+# view of the totals row.
 class IonTable(object):
-    # Extract ion table data from procarFile.
-    # The next line read should be the first line of the table, containing ion 1
-    def __init__(self, procarFile, procar, tableId):
-        if procar.storeIds:
-            self.tableId = tableId
-        # read data for each ion
-        self.ions = []
-        for ionId in range(1, procar.Ni+1):
-            if procar.lmDecomposed:
-                self.ions.append(Ion(procarFile, procar, ionId))
-            else:
-                self.ions.append(IonTotalOnly(procarFile, procar, ionId))
-        # read row containing totals
-        if procar.lmDecomposed:
-            self.tot = Ion(procarFile, procar, 0)
-        else:
-            self.tot = IonTotalOnly(procarFile, procar, 0)
+    __slots__ = ('procar', 'kIdx', 'bandIdx', 'tableIdx')
+
+    def __init__(self, procar, kIdx, bandIdx, tableIdx):
+        self.procar = procar
+        self.kIdx = kIdx
+        self.bandIdx = bandIdx
+        self.tableIdx = tableIdx
+
+    tableId = property(lambda self: self.tableIdx+1)
+
+    @property
+    def data(self):
+        return self.procar.ionData[self.kIdx, self.bandIdx, self.tableIdx]
+
+    @property
+    def surface(self):
+        return bool(self.procar.surface[self.kIdx, self.bandIdx, self.tableIdx])
+
+    @property
+    def ions(self):
+        return _Views(self.procar.Ni, lambda index: self._View(index, index+1))
+
+    @property
+    def tot(self):
+        return self._View(self.procar.Ni, 0)
 
     # Return data for the ion with id given by ionId in the PROCAR file
     # format (the first id is 1, not 0).
     def Ion(self, ionId):
-        return self.ions[ionId-1]
+        return self._View(ionId-1, ionId)
+
+    # Return the entries of PROCAR.SquareSums for every row of the table
+    # (including the totals row).
+    def SquareSums(self):
+        return self.procar.SquareSums()[self.kIdx, self.bandIdx, self.tableIdx]
+
+    def _View(self, index, ionId):
+        if self.procar.lmDecomposed:
+            return Ion(self, index, ionId)
+        return IonTotalOnly(self, index, ionId)
+
+# Return a property reading entry index of an ion view's row.
+def _Column(index):
+    return property(lambda self: self.row[index])
 
 # Represents data for one ion, belonging to a (k-point, band, ionTable).
 # Contains properties ionId, s, py, pz, px, dxy, dyz, dz2, dxz, dx2, tot.
+# The values are read from row, the view of row index of the parent
+# IonTable table's data.
 class Ion(object):
-    def __init__(self, procarFile, procar, ionId):
-        if procar.storeIds:
-            self.ionId = ionId
-        # each entry in the line is always separated by spaces
-        l = procarFile.readline().strip().split()
-        self.s, self.py, self.pz, self.px = map(float, [l[1], l[2], l[3], l[4]])
-        self.dxy, self.dyz, self.dz2, self.dxz = map(float, [l[5], l[6], l[7], l[8]])
-        self.dx2, self.tot = map(float, [l[9], l[10]])
+    __slots__ = ('table', 'index', 'row', 'ionId')
 
+    def __init__(self, table, index, ionId):
+        self.table = table
+        self.index = index
+        self.row = table.data[index]
+        self.ionId = ionId
+
+    s, py, pz, px = _Column(0), _Column(1), _Column(2), _Column(3)
+    dxy, dyz, dz2, dxz = _Column(4), _Column(5), _Column(6), _Column(7)
+    dx2, tot = _Column(8), _Column(9)
+
+    # Return the sum of squares of the lm-decomposed columns
+    # (see PROCAR.SquareSums).
     def SquareSum(self):
-        return sum(map(lambda x: x*x, [self.s, self.py, self.pz, self.px,
-                                   self.dxy, self.dyz, self.dz2, self.dxz,
-                                   self.dx2]))
+        return self.table.SquareSums()[self.index]
 
 # Represents data for one ion, belonging to a (k-point, band, ionTable).
-# Discards lm-decomposed data. Contains properties ionId, tot.
+# Exposes only the total column, the single entry of row.
+# Contains properties ionId, tot.
 class IonTotalOnly(object):
-    def __init__(self, procarFile, procar, ionId):
-        if procar.storeIds:
-            self.ionId = ionId
-        # each entry in the line is always separated by spaces
-        l = procarFile.readline().strip().split()
-        self.tot = float(l[10])
+    __slots__ = ('table', 'index', 'row', 'ionId')
+
+    def __init__(self, table, index, ionId):
+        self.table = table
+        self.index = index
+        self.row = table.data[index]
+        self.ionId = ionId
+
+    tot = _Column(-1)
 
+    # Return the square of the total column (see PROCAR.SquareSums).
     def SquareSum(self):
-        return self.tot*self.tot
+        return self.table.SquareSums()[self.index]
 
 if __name__ == "__main__":
     # test - TODO arguments?
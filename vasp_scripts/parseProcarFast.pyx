@@ -0,0 +1,252 @@
+# parseProcarFast.pyx: Cython-compiled PROCAR parser
+#
+# Copyright (c) 2013 Tim Lovorn (tflovorn@crimson.ua.edu)
+# Released under the MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+#     The above copyright notice and this permission notice shall be included in
+#     all copies or substantial portions of the Software.
+#
+#     THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#     IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#     FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#     AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#     LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#     OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#     THE SOFTWARE.
+#
+#
+# A Cython version of parseProcarJit.ParseProcar. Once compiled it is a
+# plain shared library, so unlike the numba version there is no compilation
+# (or loading of cached compiled code) the first time a PROCAR is parsed;
+# parseProcar prefers it when it has been built. Compile it with
+#     cythonize -i parseProcarFast.pyx
+# or, to parse k-points in parallel, with OpenMP enabled:
+#     CFLAGS=-fopenmp LDFLAGS=-fopenmp cythonize -i parseProcarFast.pyx
+#
+# cython: boundscheck=False, wraparound=False, cdivision=True
+from cython.parallel import prange
+import numpy as np
+
+cdef enum:
+    _NEWLINE = 10   # b'\n'
+    _SPACE = 32     # b' '
+    _TAB = 9        # b'\t'
+    _CR = 13        # b'\r'
+    _MINUS = 45     # b'-'
+    _PLUS = 43      # b'+'
+    _DOT = 46       # b'.'
+    _ZERO = 48      # b'0'
+
+cdef inline bint _IsSpace(unsigned char c) noexcept nogil:
+    return c == _SPACE or c == _TAB or c == _CR
+
+cdef inline bint _IsDigit(unsigned char c) noexcept nogil:
+    return c >= _ZERO and c <= _ZERO + 9
+
+# Return the index of the first character of the line following the one
+# containing buf[i].
+cdef inline Py_ssize_t _SkipLine(const unsigned char[::1] buf,
+                                 Py_ssize_t i) noexcept nogil:
+    cdef Py_ssize_t n = buf.shape[0]
+    while i < n and buf[i] != _NEWLINE:
+        i += 1
+    return i+1
+
+# Return the index of the first character in buf at or after i which is
+# not a space or tab.
+cdef inline Py_ssize_t _SkipSpace(const unsigned char[::1] buf,
+                                  Py_ssize_t i) noexcept nogil:
+    cdef Py_ssize_t n = buf.shape[0]
+    while i < n and _IsSpace(buf[i]):
+        i += 1
+    return i
+
+# Skip the whitespace-separated token starting at or after buf[i] and
+# return the index just past it.
+cdef inline Py_ssize_t _SkipToken(const unsigned char[::1] buf,
+                                  Py_ssize_t i) noexcept nogil:
+    cdef Py_ssize_t n = buf.shape[0]
+    i = _SkipSpace(buf, i)
+    while i < n and not _IsSpace(buf[i]) and buf[i] != _NEWLINE:
+        i += 1
+    return i
+
+# Parse the unsigned integer starting at or after buf[i[0]] and advance
+# i[0] past it. Set i[0] to -1 if there are no digits there.
+cdef inline long _ScanInt(const unsigned char[::1] buf,
+                          Py_ssize_t* i) noexcept nogil:
+    cdef Py_ssize_t n = buf.shape[0]
+    cdef Py_ssize_t j = _SkipSpace(buf, i[0]), start = j
+    cdef long value = 0
+    while j < n and _IsDigit(buf[j]):
+        value = 10*value + (buf[j] - _ZERO)
+        j += 1
+    i[0] = j if j > start else -1
+    return value
+
+# Parse the float starting at or after buf[i[0]] and advance i[0] past it.
+# The scan stops at the first character which can't continue the number,
+# so numbers glued together by a minus sign are separated. Set i[0] to -1
+# if there is no number there (e.g. VASP's "*****" for a value which
+# overflowed its field).
+cdef inline double _ScanFloat(const unsigned char[::1] buf,
+                              Py_ssize_t* i) noexcept nogil:
+    cdef Py_ssize_t n = buf.shape[0]
+    cdef Py_ssize_t j = _SkipSpace(buf, i[0])
+    cdef double sign = 1.0, mantissa = 0.0
+    cdef long exponent = 0, expSign, digits = 0
+    if j < n and (buf[j] == _MINUS or buf[j] == _PLUS):
+        if buf[j] == _MINUS:
+            sign = -1.0
+        j += 1
+    while j < n and _IsDigit(buf[j]):
+        mantissa = 10.0*mantissa + (buf[j] - _ZERO)
+        digits += 1
+        j += 1
+    if j < n and buf[j] == _DOT:
+        j += 1
+        while j < n and _IsDigit(buf[j]):
+            mantissa = 10.0*mantissa + (buf[j] - _ZERO)
+            digits += 1
+            exponent -= 1
+            j += 1
+    if digits == 0:
+        i[0] = -1
+        return 0.0
+    # exponent marker: E or e (D or d in Fortran double precision output)
+    if j < n and (buf[j] | 32 == 101 or buf[j] | 32 == 100):
+        j += 1
+        expSign = 1
+        if j < n and (buf[j] == _MINUS or buf[j] == _PLUS):
+            if buf[j] == _MINUS:
+                expSign = -1
+            j += 1
+        # j is set to -1 if the exponent has no digits
+        exponent += expSign*_ScanInt(buf, &j)
+    i[0] = j
+    if exponent < 0:
+        return sign*mantissa/10.0**(-exponent)
+    return sign*mantissa*10.0**exponent
+
+# Return True if the bytes of buf starting at index i are those of the
+# NUL-terminated string word.
+cdef inline bint _StartsWith(const unsigned char[::1] buf, Py_ssize_t i,
+                             const char* word) noexcept nogil:
+    cdef Py_ssize_t n = buf.shape[0], c = 0
+    while word[c] != 0:
+        if i + c >= n or buf[i+c] != <unsigned char>word[c]:
+            return False
+        c += 1
+    return True
+
+# Store in offsets the index in buf of the start of each of the first
+# len(offsets) lines whose first token is "k-point". Return the number of
+# such lines found.
+cdef Py_ssize_t _KPointOffsets(const unsigned char[::1] buf,
+                               Py_ssize_t[::1] offsets) noexcept nogil:
+    cdef Py_ssize_t n = buf.shape[0], Nk = offsets.shape[0]
+    cdef Py_ssize_t found = 0, i = 0, j
+    while i < n and found < Nk:
+        j = _SkipSpace(buf, i)
+        if _StartsWith(buf, j, b'k-point'):
+            offsets[found] = i
+            found += 1
+        i = _SkipLine(buf, j)
+    return found
+
+# Parse the block of k-point k, which starts at index i of buf, into entry
+# k of the arrays (see ParseProcar). Return the index just past the last
+# value of the last ion table; the empty lines which follow it carry no
+# data and may be missing at the end of the file. Return -1 if a band entry
+# doesn't start where expected or a field which should hold a number
+# doesn't, which is also the case if the file ends inside the block.
+cdef Py_ssize_t _ParseKPoint(const unsigned char[::1] buf, Py_ssize_t i,
+                             Py_ssize_t k, float[:, ::1] kVecs,
+                             float[::1] weights, float[:, ::1] energies,
+                             float[:, ::1] occs,
+                             float[:, :, :, :, ::1] ionData) noexcept nogil:
+    cdef Py_ssize_t Nb = ionData.shape[1], numTables = ionData.shape[2]
+    cdef Py_ssize_t numRows = ionData.shape[3], ncols = ionData.shape[4]
+    cdef Py_ssize_t skipCols = 10 - ncols
+    cdef Py_ssize_t b, t, r, c, end = i
+    # " k-point    1 :    0.00000000 0.00000000 0.00000000     weight = ..."
+    i = _SkipToken(buf, i)      # "k-point"
+    _ScanInt(buf, &i)
+    if i < 0:
+        return -1
+    i = _SkipToken(buf, i)      # ":"
+    for c in range(3):
+        kVecs[k, c] = _ScanFloat(buf, &i)
+        if i < 0:
+            return -1
+    i = _SkipToken(buf, i)      # "weight"
+    i = _SkipToken(buf, i)      # "="
+    weights[k] = _ScanFloat(buf, &i)
+    if i < 0:
+        return -1
+    i = _SkipLine(buf, i)
+    i = _SkipLine(buf, i)       # empty line
+    for b in range(Nb):
+        # "band     1 # energy   -3.00000000 # occ.  1.00000000"
+        i = _SkipSpace(buf, i)
+        if not _StartsWith(buf, i, b'band'):
+            return -1
+        i = _SkipToken(buf, i)  # "band"
+        _ScanInt(buf, &i)
+        if i < 0:
+            return -1
+        i = _SkipToken(buf, i)  # "#"
+        i = _SkipToken(buf, i)  # "energy"
+        energies[k, b] = _ScanFloat(buf, &i)
+        if i < 0:
+            return -1
+        i = _SkipToken(buf, i)  # "#"
+        i = _SkipToken(buf, i)  # "occ."
+        occs[k, b] = _ScanFloat(buf, &i)
+        if i < 0:
+            return -1
+        i = _SkipLine(buf, i)
+        i = _SkipLine(buf, i)   # empty line
+        i = _SkipLine(buf, i)   # "ion      s     py     pz ..."
+        for t in range(numTables):
+            for r in range(numRows):
+                i = _SkipToken(buf, i)  # ion id or "tot"
+                # discarded columns only need to be skipped
+                for c in range(skipCols):
+                    i = _SkipToken(buf, i)
+                for c in range(ncols):
+                    ionData[k, b, t, r, c] = _ScanFloat(buf, &i)
+                    if i < 0:
+                        return -1
+                end = i
+                i = _SkipLine(buf, i)
+        i = _SkipLine(buf, i)   # empty line
+    return end
+
+# Parse the whole PROCAR held in buf into the preallocated arrays; see
+# parseProcarJit.ParseProcar. The arrays must be C-contiguous float32.
+# The k-point blocks are parsed in parallel if the module was compiled with
+# OpenMP, and sequentially otherwise. Raise ValueError if the file is cut
+# off or a block is malformed.
+def ParseProcar(const unsigned char[::1] buf, float[:, ::1] kVecs,
+                float[::1] weights, float[:, ::1] energies,
+                float[:, ::1] occs, float[:, :, :, :, ::1] ionData):
+    cdef Py_ssize_t Nk = ionData.shape[0], k
+    cdef Py_ssize_t[::1] offsets = np.empty(Nk, dtype=np.intp)
+    cdef Py_ssize_t[::1] ends = np.empty(Nk, dtype=np.intp)
+    if _KPointOffsets(buf, offsets) < Nk:
+        raise ValueError("PROCAR contains fewer k-points than declared")
+    for k in prange(Nk, nogil=True):
+        ends[k] = _ParseKPoint(buf, offsets[k], k, kVecs, weights, energies,
+                               occs, ionData)
+    for k in range(Nk):
+        if ends[k] < 0:
+            raise ValueError("PROCAR k-point %d entry is malformed or cut off"
+                             % (k+1))
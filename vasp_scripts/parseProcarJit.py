@@ -0,0 +1,254 @@
+# parseProcarJit.py: Numba-compiled PROCAR parser
+#
+# Copyright (c) 2013 Tim Lovorn (tflovorn@crimson.ua.edu)
+# Released under the MIT License
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+#     The above copyright notice and this permission notice shall be included in
+#     all copies or substantial portions of the Software.
+#
+#     THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#     IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#     FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#     AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#     LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#     OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#     THE SOFTWARE.
+#
+#
+# The functions here walk the raw bytes of a PROCAR file (a uint8 array,
+# usually a memory map of the file) and write the parsed values directly into
+# the arrays allocated by parseProcar.PROCAR. They are compiled once and the
+# compiled code is cached on disk, so later runs only pay for the call.
+# Importing this module fails if numba is not installed; parseProcar then
+# falls back to its pure-Python parser.
+#
+import numba
+import numpy as np
+
+_NEWLINE = 10   # b'\n'
+_SPACE = 32     # b' '
+_TAB = 9        # b'\t'
+_CR = 13        # b'\r'
+_MINUS = 45     # b'-'
+_PLUS = 43      # b'+'
+_DOT = 46       # b'.'
+_ZERO = 48      # b'0'
+_KPOINT = np.frombuffer(b'k-point', dtype=np.uint8)
+_BAND = np.frombuffer(b'band', dtype=np.uint8)
+
+# Return the index of the first character of the line following the one
+# containing buf[i].
+@numba.njit(cache=True, nogil=True)
+def _SkipLine(buf, i):
+    n = len(buf)
+    while i < n and buf[i] != _NEWLINE:
+        i += 1
+    return i+1
+
+# Return the index of the first character in buf at or after i which is
+# not a space or tab.
+@numba.njit(cache=True, nogil=True)
+def _SkipSpace(buf, i):
+    n = len(buf)
+    while i < n and (buf[i] == _SPACE or buf[i] == _TAB or buf[i] == _CR):
+        i += 1
+    return i
+
+# Skip the whitespace-separated token starting at or after buf[i] and
+# return the index just past it.
+@numba.njit(cache=True, nogil=True)
+def _SkipToken(buf, i):
+    i = _SkipSpace(buf, i)
+    n = len(buf)
+    while (i < n and buf[i] != _SPACE and buf[i] != _TAB and buf[i] != _CR
+           and buf[i] != _NEWLINE):
+        i += 1
+    return i
+
+@numba.njit(cache=True, nogil=True)
+def _IsDigit(c):
+    return c >= _ZERO and c <= _ZERO + 9
+
+# Parse the unsigned integer starting at or after buf[i].
+# Return (value, index just past the integer), or (0, -1) if there are no
+# digits there.
+@numba.njit(cache=True, nogil=True)
+def _ScanInt(buf, i):
+    i = _SkipSpace(buf, i)
+    start = i
+    n = len(buf)
+    value = 0
+    while i < n and _IsDigit(buf[i]):
+        value = 10*value + (buf[i] - _ZERO)
+        i += 1
+    if i == start:
+        return 0, -1
+    return value, i
+
+# Parse the float starting at or after buf[i], e.g. -0.12345678 or
+# 0.1E-02. The scan stops at the first character which can't continue the
+# number, so numbers glued together by a minus sign are separated.
+# Return (value, index just past the float), or (0.0, -1) if there is no
+# number there (e.g. VASP's "*****" for a value which overflowed its field).
+@numba.njit(cache=True, nogil=True)
+def _ScanFloat(buf, i):
+    i = _SkipSpace(buf, i)
+    n = len(buf)
+    sign = 1.0
+    if i < n and (buf[i] == _MINUS or buf[i] == _PLUS):
+        if buf[i] == _MINUS:
+            sign = -1.0
+        i += 1
+    mantissa = 0.0
+    digits = 0
+    while i < n and _IsDigit(buf[i]):
+        mantissa = 10.0*mantissa + (buf[i] - _ZERO)
+        digits += 1
+        i += 1
+    exponent = 0
+    if i < n and buf[i] == _DOT:
+        i += 1
+        while i < n and _IsDigit(buf[i]):
+            mantissa = 10.0*mantissa + (buf[i] - _ZERO)
+            digits += 1
+            exponent -= 1
+            i += 1
+    if digits == 0:
+        return 0.0, -1
+    # exponent marker: E or e (D or d in Fortran double precision output)
+    if i < n and (buf[i] | 32 == 101 or buf[i] | 32 == 100):
+        i += 1
+        expSign = 1
+        if i < n and (buf[i] == _MINUS or buf[i] == _PLUS):
+            if buf[i] == _MINUS:
+                expSign = -1
+            i += 1
+        expValue, i = _ScanInt(buf, i)
+        if i < 0:
+            return 0.0, -1
+        exponent += expSign*expValue
+    if exponent < 0:
+        return sign*mantissa/10.0**(-exponent), i
+    return sign*mantissa*10.0**exponent, i
+
+# Return True if the bytes of buf starting at index i are those of word.
+@numba.njit(cache=True, nogil=True)
+def _StartsWith(buf, i, word):
+    if i + len(word) > len(buf):
+        return False
+    for c in range(len(word)):
+        if buf[i+c] != word[c]:
+            return False
+    return True
+
+# Return the index in buf of the start of each of the first Nk lines whose
+# first token is "k-point". Raise ValueError if there are fewer than Nk.
+@numba.njit(cache=True, nogil=True)
+def _KPointOffsets(buf, Nk):
+    offsets = np.empty(Nk, dtype=np.int64)
+    found = 0
+    i = 0
+    n = len(buf)
+    while i < n and found < Nk:
+        j = _SkipSpace(buf, i)
+        if _StartsWith(buf, j, _KPOINT):
+            offsets[found] = i
+            found += 1
+        i = _SkipLine(buf, j)
+    if found < Nk:
+        raise ValueError("PROCAR contains fewer k-points than declared")
+    return offsets
+
+# Parse the block of k-point k, which starts at index i of buf, into entry
+# k of the arrays (see ParseProcar). Return the index just past the last
+# value of the last ion table; the empty lines which follow it carry no
+# data and may be missing at the end of the file. Return -1 if a band entry
+# doesn't start where expected or a field which should hold a number
+# doesn't, which is also the case if the file ends inside the block.
+@numba.njit(cache=True, nogil=True)
+def _ParseKPoint(buf, i, k, kVecs, weights, energies, occs, ionData):
+    Nk, Nb, numTables, numRows, ncols = ionData.shape
+    skipCols = 10 - ncols
+    end = i
+    # " k-point    1 :    0.00000000 0.00000000 0.00000000     weight = ..."
+    i = _SkipToken(buf, i)      # "k-point"
+    _, i = _ScanInt(buf, i)
+    if i < 0:
+        return -1
+    i = _SkipToken(buf, i)      # ":"
+    for c in range(3):
+        kVecs[k, c], i = _ScanFloat(buf, i)
+        if i < 0:
+            return -1
+    i = _SkipToken(buf, i)      # "weight"
+    i = _SkipToken(buf, i)      # "="
+    weights[k], i = _ScanFloat(buf, i)
+    if i < 0:
+        return -1
+    i = _SkipLine(buf, i)
+    i = _SkipLine(buf, i)       # empty line
+    for b in range(Nb):
+        # "band     1 # energy   -3.00000000 # occ.  1.00000000"
+        i = _SkipSpace(buf, i)
+        if not _StartsWith(buf, i, _BAND):
+            return -1
+        i = _SkipToken(buf, i)  # "band"
+        _, i = _ScanInt(buf, i)
+        if i < 0:
+            return -1
+        i = _SkipToken(buf, i)  # "#"
+        i = _SkipToken(buf, i)  # "energy"
+        energies[k, b], i = _ScanFloat(buf, i)
+        if i < 0:
+            return -1
+        i = _SkipToken(buf, i)  # "#"
+        i = _SkipToken(buf, i)  # "occ."
+        occs[k, b], i = _ScanFloat(buf, i)
+        if i < 0:
+            return -1
+        i = _SkipLine(buf, i)
+        i = _SkipLine(buf, i)   # empty line
+        i = _SkipLine(buf, i)   # "ion      s     py     pz ..."
+        for t in range(numTables):
+            for r in range(numRows):
+                i = _SkipToken(buf, i)  # ion id or "tot"
+                # discarded columns only need to be skipped, not parsed
+                for c in range(skipCols):
+                    i = _SkipToken(buf, i)
+                for c in range(ncols):
+                    value, i = _ScanFloat(buf, i)
+                    if i < 0:
+                        return -1
+                    ionData[k, b, t, r, c] = value
+                end = i
+                i = _SkipLine(buf, i)
+        i = _SkipLine(buf, i)   # empty line
+    return end
+
+# Parse the whole PROCAR held in buf into the preallocated arrays, which
+# determine the number of k-points, bands, ions, tables and kept columns:
+# kVecs[Nk, 3], weights[Nk], energies[Nk, Nb], occs[Nk, Nb] and
+# ionData[Nk, Nb, numTables, Ni+1, ncols]. Only the last ncols of the 10
+# numeric columns of each ion table row are kept. Values are scanned in
+# double precision and rounded to the type of the arrays when stored.
+# The start of each k-point block is located first; the blocks are then
+# parsed in parallel, each thread writing only to its own k-point entries.
+# Raise ValueError if the file is cut off or a block is malformed.
+@numba.njit(cache=True, nogil=True, parallel=True)
+def ParseProcar(buf, kVecs, weights, energies, occs, ionData):
+    Nk = ionData.shape[0]
+    offsets = _KPointOffsets(buf, Nk)
+    ends = np.empty(Nk, dtype=np.int64)
+    for k in numba.prange(Nk):
+        ends[k] = _ParseKPoint(buf, offsets[k], k, kVecs, weights, energies,
+                               occs, ionData)
+    for k in range(Nk):
+        if ends[k] < 0:
+            raise ValueError("PROCAR k-point entry is malformed or cut off")
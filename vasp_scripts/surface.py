@@ -21,14 +21,16 @@
 #     OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 #     THE SOFTWARE.
 #
+import numpy as np
 import parseProcar
 
 # For each ion table in procar, if the quantities in the 'total' column are
 # concentrated close enough to the surface then mark the table as a surface
-# state by adding the property table.surface=True; otherwise set
-# table.surface=False. For a given (kpoint, band) pair, if any tables have
-# the surface property set to true, set band.surface=True; otherwise set
-# band.surface=False.
+# state by setting the corresponding entry of procar.surface to True (so that
+# table.surface=True); otherwise set it to False. For a given (kpoint, band)
+# pair, band.surface is True if any of its tables are marked. The top and
+# bottom surface weights of each table are stored in procar.top and
+# procar.bottom (available as band.top and band.bottom).
 #
 # Whether or not an ion table represents a surface state is controlled by
 # the depth and threshold parameters. Starting with ion #1 and moving inward
@@ -46,22 +48,27 @@ import parseProcar
 #
 # strategy = 'SquareSum' or 'Sum' - are PROCAR values squared before
 # summation, or not?
+#
+# All tables are handled at once using the arrays stored in procar.
 def MarkSurfaceStates(procar, depth, threshold, strategy='SumSquare'):
-    for kPoint in procar.kPoints:
-        for band in kPoint.bands:
-            marked = False
-            for table in band.tables:
-                isSurf, top, bottom = IsSurface(table, depth, threshold, strategy)
-                band.top.append(top)
-                band.bottom.append(bottom)
-                if isSurf:
-                    table.surface = True
-                    marked = True
-                else:
-                    table.surface = False
-            if marked:
-                print("marked: kPoint " + str(kPoint.kId) + " band " + str(band.bandId))
-                band.surface = True
+    procar.surface[...] = False
+    procar.top[...] = 0.0
+    procar.bottom[...] = 0.0
+    if strategy not in ['SumSquare', 'Sum']:
+        print("error: invalid strategy")
+        return
+    sumTop, sumBottom, sumAll = _SurfaceSums(procar.ionData,
+                                             procar.SquareSums(), depth,
+                                             strategy)
+    isSurf, top, bottom = _SurfaceWeights(sumTop, sumBottom, sumAll, threshold)
+    procar.surface[...] = isSurf
+    procar.top[...] = top
+    procar.bottom[...] = bottom
+    for kIdx, bandIdx in np.argwhere(isSurf.any(axis=-1)):
+        for tableIdx in np.flatnonzero(isSurf[kIdx, bandIdx]):
+            index = (kIdx, bandIdx, tableIdx)
+            _PrintSums(sumTop[index], sumBottom[index], sumAll[index])
+        print("marked: kPoint " + str(kIdx+1) + " band " + str(bandIdx+1))
 
 # Return true if the given table meets the requirements for a surface state
 # as described in the documentation for MarkSurfaceStates. Return false
@@ -70,33 +77,47 @@ def IsSurface(table, depth, threshold, strategy):
     if strategy not in ['SumSquare', 'Sum']:
         print("error: invalid strategy")
         return False, 0.0, 0.0
-    Ni = len(table.ions)
-    sumTop, sumBottom, sumAll = 0.0, 0.0, 0.0
-    # iterate over ions close to the top/bottom
-    for i in range(1, Ni+1): 
-        if strategy == 'SumSquare':
-            sumAll += table.Ion(i).SquareSum()
-        if i <= depth:
-            # only here if i = 1, 2, ..., depth
-            if strategy == 'SumSquare':
-                sumTop += table.Ion(i).SquareSum()
-                sumBottom += table.Ion(Ni - i + 1).SquareSum()
-            elif strategy == 'Sum':
-                sumTop += table.Ion(i).tot
-                sumBottom += table.Ion(Ni - i + 1).tot
-    if strategy == 'Sum':
-        sumAll = abs(table.tot.tot)
-    # surface weight above threshold?
+    sumTop, sumBottom, sumAll = _SurfaceSums(table.data, table.SquareSums(),
+                                             depth, strategy)
+    isSurf, top, bottom = _SurfaceWeights(sumTop, sumBottom, sumAll, threshold)
+    if isSurf:
+        _PrintSums(sumTop, sumBottom, sumAll)
+    return bool(isSurf), float(top), float(bottom)
+
+# Return the arrays (sumTop, sumBottom, sumAll) described in the
+# documentation for MarkSurfaceStates for the ion tables in ionData, which
+# has shape (..., Ni+1, ncols), with the corresponding square sums in
+# squareSums (see parseProcar.PROCAR). The leading dimensions of ionData
+# index the tables.
+def _SurfaceSums(ionData, squareSums, depth, strategy):
+    Ni = ionData.shape[-2] - 1
+    if strategy == 'SumSquare':
+        weights = squareSums[..., :Ni]
+        sumAll = weights.sum(axis=-1)
+    elif strategy == 'Sum':
+        weights = ionData[..., :Ni, -1]
+        sumAll = abs(ionData[..., Ni, -1])
+    # sum over ions close to the top/bottom
+    sumTop = weights[..., :depth].sum(axis=-1)
+    sumBottom = weights[..., max(Ni - depth, 0):].sum(axis=-1)
+    return sumTop, sumBottom, sumAll
+
+# Return the arrays (isSurf, top, bottom) for the tables with the given
+# sums: whether each table is a surface state and its relative top and
+# bottom surface weights.
+def _SurfaceWeights(sumTop, sumBottom, sumAll, threshold):
     # note that sum(Top, Bottom, All) >= 0
-    if sumAll < 1e-9:
-        # total weight too small; assume not surface state
-        return False, 0.0, 0.0
-    if abs(sumTop/sumAll) > threshold or abs(sumBottom/sumAll) > threshold:
-        # seems to be a surface state
-        print('top: ' + str(sumTop) + ' bottom: ' + str(sumBottom) + ' total: ' + str(sumAll))
-        return True, abs(sumTop/sumAll), abs(sumBottom/sumAll)
-    # not above threshold
-    return False, abs(sumTop/sumAll), abs(sumBottom/sumAll)
+    # if the total weight is too small, assume not surface state
+    valid = sumAll >= 1e-9
+    safeAll = np.where(valid, sumAll, 1.0)
+    top = np.where(valid, abs(sumTop/safeAll), 0.0)
+    bottom = np.where(valid, abs(sumBottom/safeAll), 0.0)
+    # surface weight above threshold?
+    isSurf = valid & ((top > threshold) | (bottom > threshold))
+    return isSurf, top, bottom
+
+def _PrintSums(sumTop, sumBottom, sumAll):
+    print('top: ' + str(sumTop) + ' bottom: ' + str(sumBottom) + ' total: ' + str(sumAll))
 
 if __name__ == "__main__":
     # test - TODO arguments?
@@ -0,0 +1,336 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+import parseProcar
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+class ParseNonCollinear(unittest.TestCase):
+    def setUp(self):
+        with open("TEST_PROCAR", 'r') as f:
+            self.p = parseProcar.PROCAR(f, nonCol=True)
+
+    def test_globals(self):
+        self.assertEqual((3, 2, 3), (self.p.Nk, self.p.Nb, self.p.Ni))
+
+    def test_kpoints(self):
+        # k-point 2 has signed components which abut in the file
+        k = self.p.KPoint(2)
+        self.assertEqual(2, k.kId)
+        self.assertAlmostEqual(-0.125, k.kx)
+        self.assertAlmostEqual(0.25, k.ky)
+        self.assertAlmostEqual(-0.5, k.kz)
+        self.assertAlmostEqual(1.0/3.0, k.weight, places=6)
+
+    def test_bands(self):
+        b = self.p.KPoint(3).Band(2)
+        self.assertEqual(2, b.bandId)
+        self.assertAlmostEqual(-1.1, b.energy, places=5)
+        self.assertAlmostEqual(0.0, b.occ)
+        self.assertEqual(4, len(b.tables))
+
+    def test_ions(self):
+        table = self.p.KPoint(1).Band(1).Table(2)
+        self.assertEqual(2, table.tableId)
+        ion = table.Ion(2)
+        self.assertEqual(2, ion.ionId)
+        self.assertAlmostEqual(0.239, ion.s, places=6)
+        self.assertAlmostEqual(-0.151, ion.py, places=6)
+        self.assertAlmostEqual(0.054, ion.dx2, places=6)
+        self.assertAlmostEqual(0.283, ion.tot, places=6)
+        self.assertAlmostEqual(2.955, table.tot.tot, places=6)
+        expected = sum(x*x for x in [0.239, -0.151, -0.132, -0.092, 0.283,
+                                     0.018, 0.113, -0.049, 0.054])
+        self.assertAlmostEqual(expected, ion.SquareSum(), places=6)
+
+    def test_sequences(self):
+        self.assertEqual(3, len(self.p.kPoints))
+        self.assertEqual([1, 2, 3], [k.kId for k in self.p.kPoints])
+        self.assertEqual(3, self.p.kPoints[-1].kId)
+        ions = self.p.KPoint(1).Band(2).Table(1).ions
+        self.assertEqual(3, len(ions))
+        self.assertEqual([2, 3], [ion.ionId for ion in ions[1:]])
+        with self.assertRaises(IndexError):
+            ions[3]
+
+    def test_arrays(self):
+        self.assertEqual((3, 3), self.p.kVecs.shape)
+        self.assertEqual((3, 2), self.p.energies.shape)
+        self.assertEqual((3, 2, 4, 4, 10), self.p.ionData.shape)
+        self.assertAlmostEqual(-0.5, self.p.kVecs[1, 2])
+        self.assertAlmostEqual(0.283, self.p.ionData[0, 0, 1, 1, 9], places=6)
+
+    def test_square_sums(self):
+        sums = self.p.SquareSums()
+        self.assertEqual((3, 2, 4, 4), sums.shape)
+        table = self.p.KPoint(2).Band(1).Table(3)
+        for i in range(1, 4):
+            self.assertAlmostEqual(table.Ion(i).SquareSum(),
+                                   sum(x*x for x in table.Ion(i).row[:9]),
+                                   places=6)
+
+    def test_square_sums_lazy(self):
+        # reading ion values must not compute the square sums of the file
+        ion = self.p.KPoint(1).Band(1).Table(2).Ion(2)
+        self.assertAlmostEqual(0.283, ion.tot, places=6)
+        self.assertIsNone(self.p._squareSums)
+        ion.SquareSum()
+        self.assertIsNotNone(self.p._squareSums)
+
+    @unittest.skipUnless(pandas, "pandas is not installed")
+    def test_dataframe(self):
+        df = self.p.ToDataFrame()
+        self.assertEqual((3*2*4*4, 10), df.shape)
+        self.assertAlmostEqual(0.283, df.loc[(1, 1, 2, 2), 'tot'], places=6)
+        self.assertAlmostEqual(2.955, df.loc[(1, 1, 2, 0), 'tot'], places=6)
+        self.assertAlmostEqual(-0.151, df.loc[(1, 1, 2, 2), 'py'], places=6)
+
+    def test_total_only(self):
+        with open("TEST_PROCAR", 'r') as f:
+            p = parseProcar.PROCAR(f, nonCol=True, lmDecomposed=False,
+                                   storeIds=False)
+        table = p.KPoint(1).Band(1).Table(2)
+        self.assertAlmostEqual(0.283, table.Ion(2).tot, places=6)
+        self.assertAlmostEqual(0.283**2, table.Ion(2).SquareSum(), places=6)
+        self.assertAlmostEqual(2.955, table.tot.tot, places=6)
+
+# Return the text of a collinear PROCAR made from the non-collinear text by
+# keeping only the first ion table (the total one) of each band.
+def CollinearText(text):
+    lines = []
+    seenTot = False
+    for line in text.splitlines(True):
+        if line.startswith("band") or line.startswith(" k-point"):
+            seenTot = False
+        elif seenTot and line.strip():
+            continue
+        elif line.startswith("tot"):
+            seenTot = True
+        lines.append(line)
+    return ''.join(lines)
+
+class ParseCollinear(unittest.TestCase):
+    # a collinear file has a single ion table per band; every parser must
+    # read it as the first table of the non-collinear file
+    def setUp(self):
+        with open("TEST_PROCAR", 'r') as f:
+            self.text = f.read()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "PROCAR")
+        with open(self.path, 'w') as f:
+            f.write(CollinearText(self.text))
+        self.compiled = parseProcar._compiled
+
+    def tearDown(self):
+        parseProcar._compiled = self.compiled
+        shutil.rmtree(self.dir)
+
+    def test_parsers_agree(self):
+        for lmDecomposed in [True, False]:
+            expected = parseProcar.PROCAR(io.StringIO(self.text), nonCol=True,
+                                          lmDecomposed=lmDecomposed)
+            parseProcar._compiled = None
+            with open(self.path, 'r') as f:
+                parsed = [parseProcar.PROCAR(f, nonCol=False,
+                                             lmDecomposed=lmDecomposed)]
+            for compiled in compiledParsers:
+                parseProcar._compiled = compiled
+                with open(self.path, 'r') as f:
+                    parsed.append(parseProcar.PROCAR(
+                        f, nonCol=False, lmDecomposed=lmDecomposed))
+            for p in parsed:
+                self.assertEqual(1, p.numTables)
+                self.assertEqual(1, len(p.KPoint(1).Band(1).tables))
+                for name in ['kVecs', 'weights', 'energies', 'occs']:
+                    np.testing.assert_array_equal(getattr(expected, name),
+                                                  getattr(p, name))
+                np.testing.assert_array_equal(expected.ionData[:, :, :1],
+                                              p.ionData)
+
+class ParseFileLike(unittest.TestCase):
+    # file-like objects without a file on disk use the pure-Python parser;
+    # the result must match that of parsing the file itself
+    def test_matches_file(self):
+        with open("TEST_PROCAR", 'r') as f:
+            text = f.read()
+        for lmDecomposed in [True, False]:
+            with open("TEST_PROCAR", 'r') as f:
+                expected = parseProcar.PROCAR(f, nonCol=True,
+                                              lmDecomposed=lmDecomposed)
+            p = parseProcar.PROCAR(io.StringIO(text), nonCol=True,
+                                   lmDecomposed=lmDecomposed)
+            self.assertEqual(expected.ionData.shape, p.ionData.shape)
+            for name in ['kVecs', 'weights', 'energies', 'occs', 'ionData']:
+                np.testing.assert_allclose(getattr(expected, name),
+                                           getattr(p, name), atol=1e-6)
+
+    def test_truncated(self):
+        with open("TEST_PROCAR", 'r') as f:
+            text = f.read()
+        with self.assertRaises(ValueError):
+            parseProcar.PROCAR(io.StringIO(text[:len(text)//2]), nonCol=True)
+
+    def test_descriptor(self):
+        # a file opened from a descriptor is still mapped and parsed in place
+        with open("TEST_PROCAR", 'r') as f:
+            expected = parseProcar.PROCAR(f, nonCol=True)
+        with open(os.open("TEST_PROCAR", os.O_RDONLY), 'r') as f:
+            self.assertIsNotNone(parseProcar._MapFile(f))
+            p = parseProcar.PROCAR(f, nonCol=True)
+        np.testing.assert_array_equal(expected.ionData, p.ionData)
+
+# Compiled parsers available in this installation.
+compiledParsers = []
+for name in ['parseProcarJit', 'parseProcarFast']:
+    try:
+        compiledParsers.append(__import__(name))
+    except ImportError:
+        pass
+
+class ParseBadFile(unittest.TestCase):
+    def setUp(self):
+        with open("TEST_PROCAR", 'r') as f:
+            self.text = f.read()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "PROCAR")
+        self.compiled = parseProcar._compiled
+
+    def tearDown(self):
+        parseProcar._compiled = self.compiled
+        shutil.rmtree(self.dir)
+
+    # Check that text fails to parse with ValueError when read from a file
+    # on disk with each compiled parser, and with the pure-Python parser.
+    def assertRejected(self, text):
+        with self.assertRaises(ValueError):
+            parseProcar.PROCAR(io.StringIO(text), nonCol=True)
+        with open(self.path, 'w') as f:
+            f.write(text)
+        for compiled in compiledParsers:
+            parseProcar._compiled = compiled
+            with open(self.path, 'r') as f:
+                with self.assertRaises(ValueError):
+                    parseProcar.PROCAR(f, nonCol=True)
+
+    def test_incomplete_header(self):
+        for text in ["", self.text.splitlines(True)[0]]:
+            self.assertRejected(text)
+
+    def test_truncated_last_kpoint(self):
+        start = self.text.index(" k-point    3")
+        self.assertRejected(self.text[:start + (len(self.text)-start)//2])
+
+    def test_truncated_last_row(self):
+        # the last row of the file lacks its last value
+        self.assertRejected(self.text.rstrip()[:-len(" -0.004")])
+
+    def test_stripped_blank_lines(self):
+        # the empty lines after the last ion table carry no data
+        expected = parseProcar.PROCAR(io.StringIO(self.text), nonCol=True)
+        for text in [self.text.rstrip('\n') + '\n', self.text.rstrip('\n')]:
+            parsers = [(None, io.StringIO(text))]
+            with open(self.path, 'w') as f:
+                f.write(text)
+            for compiled in compiledParsers:
+                parsers.append((compiled, open(self.path, 'r')))
+            for compiled, f in parsers:
+                parseProcar._compiled = compiled
+                with f:
+                    p = parseProcar.PROCAR(f, nonCol=True)
+                np.testing.assert_array_equal(expected.ionData, p.ionData)
+
+    def test_stops_reading(self):
+        # the background reading thread must be done once the error is raised,
+        # even if it was blocked on entries left to read
+        start = self.text.index(" k-point    1")
+        header = self.text[:start].replace("k-points:    3", "k-points:   30")
+        body = self.text[start:]
+        body = body.replace("band", "xxxx", 1) + 9*body
+        threads = threading.active_count()
+        traceback = None
+        try:
+            parseProcar.PROCAR(io.StringIO(header + body), nonCol=True)
+        except ValueError as e:
+            # hold on to the traceback (assertRaises would clear its frames)
+            traceback = e.__traceback__
+        self.assertIsNotNone(traceback)
+        self.assertEqual(threads, threading.active_count())
+
+    def test_not_a_number(self):
+        # VASP writes asterisks for a value which overflows its field
+        self.assertRejected(self.text.replace("0.239", "*****", 1))
+        self.assertRejected(self.text.replace("-3.00000000", "***********", 1))
+
+    def test_missing_band(self):
+        start = self.text.index(" k-point    2")
+        band = self.text.index("band     2", start)
+        self.assertRejected(self.text[:band] + "xxxx" + self.text[band+4:])
+
+class LoadCached(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "PROCAR")
+        shutil.copy("TEST_PROCAR", self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_reuses_cache(self):
+        parsed = parseProcar.PROCAR.LoadCached(self.path, nonCol=True)
+        self.assertTrue(os.path.exists(self.path + ".npz"))
+        cached = parseProcar.PROCAR.LoadCached(self.path, nonCol=True)
+        self.assertEqual((3, 2, 3), (cached.Nk, cached.Nb, cached.Ni))
+        for name in ['kVecs', 'weights', 'energies', 'occs', 'ionData']:
+            np.testing.assert_array_equal(getattr(parsed, name),
+                                          getattr(cached, name))
+        self.assertAlmostEqual(0.283, cached.KPoint(1).Band(1).Table(2).Ion(2).tot,
+                               places=6)
+
+    def test_invalidated(self):
+        parseProcar.PROCAR.LoadCached(self.path, nonCol=True)
+        # a cache written with other options or for another version of the
+        # file must not be used
+        p = parseProcar.PROCAR.LoadCached(self.path, nonCol=True,
+                                          lmDecomposed=False)
+        self.assertEqual(1, p.ncols)
+        with open(self.path, 'a') as f:
+            f.write("\n")
+        p = parseProcar.PROCAR.LoadCached(self.path, nonCol=True,
+                                          lmDecomposed=False)
+        self.assertEqual(os.stat(self.path).st_size,
+                         np.load(self.path + ".npz")['meta'][0])
+
+    def test_explicit_cache_path(self):
+        cachePath = os.path.join(self.dir, "cache.dat")
+        parseProcar.PROCAR.LoadCached(self.path, nonCol=True,
+                                      cachePath=cachePath)
+        self.assertTrue(os.path.exists(cachePath))
+        self.assertEqual(["PROCAR", "cache.dat"], sorted(os.listdir(self.dir)))
+        # the second call must load the cache rather than reparse the file
+        os.utime(cachePath, (0, 0))
+        cached = parseProcar.PROCAR.LoadCached(self.path, nonCol=True,
+                                               cachePath=cachePath)
+        self.assertEqual(0, os.stat(cachePath).st_mtime)
+        self.assertAlmostEqual(0.283, cached.KPoint(1).Band(1).Table(2).Ion(2).tot,
+                               places=6)
+
+    def test_bad_cache(self):
+        # empty and cut-off caches are ignored and replaced
+        parseProcar.PROCAR.LoadCached(self.path, nonCol=True)
+        with open(self.path + ".npz", 'rb') as f:
+            data = f.read()
+        for contents in [b"", data[:len(data)//2]]:
+            with open(self.path + ".npz", 'wb') as f:
+                f.write(contents)
+            p = parseProcar.PROCAR.LoadCached(self.path, nonCol=True)
+            self.assertEqual((3, 2, 3), (p.Nk, p.Nb, p.Ni))
+            self.assertEqual(len(data), os.stat(self.path + ".npz").st_size)
+
+if __name__ == "__main__":
+    unittest.main()
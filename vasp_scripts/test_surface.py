@@ -0,0 +1,114 @@
+import contextlib
+import io
+import unittest
+import numpy as np
+import parseProcar
+import surface
+
+# Return (top, bottom) surface weights of table computed ion by ion, as
+# described in the documentation for surface.MarkSurfaceStates.
+def ReferenceWeights(table, depth, strategy):
+    ions = list(table.ions)
+    if strategy == 'SumSquare':
+        weights = [ion.SquareSum() for ion in ions]
+        sumAll = sum(weights)
+    else:
+        weights = [ion.tot for ion in ions]
+        sumAll = abs(table.tot.tot)
+    if sumAll < 1e-9:
+        return 0.0, 0.0
+    top = sum(weights[:depth])
+    bottom = sum(weights[max(len(ions) - depth, 0):]) if depth > 0 else 0.0
+    return abs(top/sumAll), abs(bottom/sumAll)
+
+class MarkSurfaceStates(unittest.TestCase):
+    def setUp(self):
+        with open("TEST_PROCAR", 'r') as f:
+            self.p = parseProcar.PROCAR(f, nonCol=True)
+
+    def Mark(self, depth, threshold, strategy):
+        with contextlib.redirect_stdout(io.StringIO()):
+            surface.MarkSurfaceStates(self.p, depth, threshold, strategy)
+
+    def Tables(self):
+        for k in self.p.kPoints:
+            for b in k.bands:
+                for table in b.tables:
+                    yield table
+
+    def test_matches_reference(self):
+        for strategy in ['SumSquare', 'Sum']:
+            for depth in [0, 1, 2, 3, 5]:
+                self.Mark(depth, 0.5, strategy)
+                for table in self.Tables():
+                    index = (table.kIdx, table.bandIdx, table.tableIdx)
+                    top, bottom = ReferenceWeights(table, depth, strategy)
+                    self.assertAlmostEqual(top, self.p.top[index], places=5)
+                    self.assertAlmostEqual(bottom, self.p.bottom[index],
+                                           places=5)
+                    self.assertEqual(top > 0.5 or bottom > 0.5, table.surface)
+
+    def test_depth_zero(self):
+        # no ions are close enough to either surface
+        for strategy in ['SumSquare', 'Sum']:
+            self.Mark(0, 0.0, strategy)
+            self.assertFalse(self.p.surface.any())
+            self.assertFalse(self.p.top.any())
+            self.assertFalse(self.p.bottom.any())
+
+    def test_depth_past_ions(self):
+        # every ion is close to both surfaces, so all weight is surface weight
+        self.Mark(self.p.Ni + 2, 0.99, 'SumSquare')
+        self.assertTrue(self.p.surface.all())
+        np.testing.assert_allclose(self.p.top, 1.0, rtol=1e-5)
+        np.testing.assert_allclose(self.p.bottom, 1.0, rtol=1e-5)
+        # with plain sums the weight is relative to the totals row
+        self.Mark(self.p.Ni + 2, 0.5, 'Sum')
+        for table in self.Tables():
+            index = (table.kIdx, table.bandIdx, table.tableIdx)
+            expected = abs(sum(ion.tot for ion in table.ions)/table.tot.tot)
+            self.assertAlmostEqual(expected, self.p.top[index], places=5)
+            self.assertAlmostEqual(expected, self.p.bottom[index], places=5)
+
+    def test_one_table(self):
+        # weights of the first and last ions of k-point 1, band 1, table 2
+        table = self.p.KPoint(1).Band(1).Table(2)
+        tots = [ion.tot for ion in table.ions]
+        self.Mark(1, 0.0, 'Sum')
+        self.assertAlmostEqual(abs(tots[0]/2.955), self.p.top[0, 0, 1],
+                               places=5)
+        self.assertAlmostEqual(abs(tots[2]/2.955), self.p.bottom[0, 0, 1],
+                               places=5)
+        self.assertTrue(table.surface)
+
+    def test_invalid_strategy(self):
+        self.Mark(1, 0.0, 'Sum')
+        self.Mark(1, 0.0, 'Product')
+        self.assertFalse(self.p.surface.any())
+
+class IsSurface(unittest.TestCase):
+    def setUp(self):
+        with open("TEST_PROCAR", 'r') as f:
+            self.p = parseProcar.PROCAR(f, nonCol=True)
+
+    def test_matches_mark(self):
+        for strategy in ['SumSquare', 'Sum']:
+            for depth in [0, 1, 3, 5]:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    surface.MarkSurfaceStates(self.p, depth, 0.4, strategy)
+                for k in self.p.kPoints:
+                    for b in k.bands:
+                        for table in b.tables:
+                            index = (k.kIdx, b.bandIdx, table.tableIdx)
+                            with contextlib.redirect_stdout(io.StringIO()):
+                                isSurf, top, bottom = surface.IsSurface(
+                                    table, depth, 0.4, strategy)
+                            self.assertEqual(bool(self.p.surface[index]),
+                                             isSurf)
+                            self.assertAlmostEqual(self.p.top[index], top,
+                                                   places=6)
+                            self.assertAlmostEqual(self.p.bottom[index],
+                                                   bottom, places=6)
+
+if __name__ == "__main__":
+    unittest.main()